@@ -2,23 +2,33 @@ import os
 import logging
 import time
 import csv
+import codecs
 import asyncio
-import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import zipfile
-import io
+import re
 import platform
 import shutil
+import subprocess
+import json
+import copy
+import functools
+import itertools
+import tempfile
 from dotenv import load_dotenv
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
-from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import (
+    TimeoutException, StaleElementReferenceException, JavascriptException, WebDriverException
+)
 from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from watchdog.observers import Observer
+from watchdog.events import PatternMatchingEventHandler
 from datetime import datetime
 
 # ---------------------------------------------
@@ -27,14 +37,97 @@ from datetime import datetime
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def setup_chrome_options():
-    """Set up Chrome options for the webdriver."""
+load_dotenv()
+
+# GDE credentials, resolved once. GDE_USERNAME/GDE_PASSWORD take precedence over
+# USERNAME/PASSWORD (on Windows USERNAME is already set to the OS account name).
+GDE_USER = os.getenv("GDE_USERNAME") or os.getenv("USERNAME")
+GDE_PASS = os.getenv("GDE_PASSWORD") or os.getenv("PASSWORD")
+
+# Explicit-wait timings. 'poll' is the WebDriverWait poll interval, 'retry' the
+# longest pause between retry attempts (retries back off from 'poll' up to it).
+# Pick a profile with SLEEP_PROFILE=fast|default|slow.
+_SLEEP_PROFILES = {
+    'fast': {'poll': 0.05, 'retry': 0.5},
+    'default': {'poll': 0.1, 'retry': 1.0},
+    'slow': {'poll': 0.25, 'retry': 3.0},
+}
+SLEEP_PROFILE = _SLEEP_PROFILES.get(os.getenv("SLEEP_PROFILE", "default"), _SLEEP_PROFILES['default'])
+
+# Completed downloads are collected here; each worker downloads into its own
+# worker-<id> subdirectory so concurrent downloads never see each other's files.
+DOWNLOADS_DIR = os.path.abspath("./downloads")
+
+# Directory of this script (chromedriver cache, debug screenshots) and the
+# results directory under the working directory, resolved once
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(os.getcwd(), "data")
+
+# Seconds to wait for an expediente's download (and for leftover downloads at
+# the end of the run); raise DOWNLOAD_TIMEOUT for very large expedientes
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "90"))
+
+# Number of Chrome instances processing expedientes concurrently
+POOL_SIZE = int(os.getenv("POOL_SIZE", "4"))
+
+# Run Chrome without a window; set HEADLESS=0 to watch the browser while debugging
+HEADLESS = os.getenv("HEADLESS", "1") == "1"
+
+# Save diagnostic screenshots when navigation fails; set GDE_DEBUG=1 to enable
+DEBUG_SCREENSHOTS = os.getenv("GDE_DEBUG") == "1"
+
+# Shared HTTP session so driver lookups reuse pooled TLS connections
+_HTTP = requests.Session()
+_HTTP.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=Retry(total=3, backoff_factor=0.3)))
+
+# Installed on every new document via CDP: keeps window.__loadingIdle in sync
+# with the visibility of ZK loading indicators, so waits read one boolean.
+LOADER_JS = """
+(function() {
+    function update() {
+        window.__loadingIdle = !Array.from(document.querySelectorAll('.z-loading')).some(
+            e => e.offsetParent !== null && !e.style.display.includes('none'));
+    }
+    function install() {
+        update();
+        new MutationObserver(update).observe(document.body, {
+            subtree: true, childList: true, attributes: true, attributeFilter: ['style', 'class']
+        });
+    }
+    if (document.body) install(); else document.addEventListener('DOMContentLoaded', install);
+})();
+"""
+
+# Resources the scraper never needs; scripts and XHR stay allowed because the ZK UI depends on them
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.mp4', '*.webm', '*.mp3',
+    '*google-analytics*', '*googletagmanager*',
+]
+
+@functools.lru_cache(maxsize=None)
+def _base_options():
+    """
+    Build the Chrome options shared by every worker. Built once; callers must
+    copy it before adding worker-specific settings.
+    """
     chrome_options = Options()
     chrome_options.add_argument('--no-sandbox')
     chrome_options.add_argument('--disable-dev-shm-usage')
     chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--window-size=1920,1080')
-    chrome_options.add_argument('--start-maximized')
+    if HEADLESS:
+        chrome_options.add_argument('--headless=new')
+    chrome_options.add_argument('--window-size=1280,900')
+    chrome_options.add_argument('--disable-background-networking')
+    chrome_options.add_argument('--disable-renderer-backgrounding')
+    chrome_options.add_argument('--disable-backgrounding-occluded-windows')
+    chrome_options.add_argument('--disable-features=TranslateUI,MediaRouter,OptimizationHints,IsolateOrigins,site-per-process')
+    # Each worker drives a single tab on a single site; one renderer process is enough
+    chrome_options.add_argument('--disable-site-isolation-trials')
+    chrome_options.add_argument('--renderer-process-limit=1')
+    chrome_options.add_argument('--mute-audio')
+    chrome_options.add_argument('--disable-sync')
+    chrome_options.add_argument('--no-default-browser-check')
     chrome_options.add_argument('--disable-extensions')
     chrome_options.add_argument('--disable-popup-blocking')
     chrome_options.add_argument('--ignore-certificate-errors')
@@ -42,17 +135,28 @@ def setup_chrome_options():
     chrome_options.add_argument('--disable-blink-features=AutomationControlled')
     chrome_options.add_argument('--disable-web-security')
     chrome_options.add_argument('--allow-running-insecure-content')
+    chrome_options.add_argument('--blink-settings=imagesEnabled=false')
     chrome_options.add_argument(
         '--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
         'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36'
     )
     chrome_options.add_experimental_option('excludeSwitches', ['enable-automation'])
     chrome_options.add_experimental_option('useAutomationExtension', False)
+    return chrome_options
+
+def _with_download_dir(base_options, download_dir, profile_dir):
+    """
+    Return a copy of base_options downloading into download_dir and keeping
+    cookies in the persistent profile_dir between runs.
+    """
+    chrome_options = copy.deepcopy(base_options)
+    # Chrome locks a user data dir per process, so each worker needs its own
+    chrome_options.add_argument(f'--user-data-dir={os.path.abspath(profile_dir)}')
+    chrome_options.add_argument('--profile-directory=Default')
     
     # Set up downloads directory with absolute path
-    download_dir = os.path.abspath("./downloads")
+    download_dir = os.path.abspath(download_dir)
     os.makedirs(download_dir, exist_ok=True)
-    logger.info(f"Using downloads directory: {download_dir}")
     
     prefs = {
         'download.default_directory': download_dir,
@@ -70,16 +174,69 @@ def setup_chrome_options():
     logger.info(f"Chrome options configured with download directory: {download_dir}")
     return chrome_options, download_dir
 
+def get_chrome_major_version():
+    """Return the major version of the locally installed Chrome as a string, or None."""
+    try:
+        if platform.system() == "Windows":
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Google\Chrome\BLBeacon") as key:
+                version = winreg.QueryValueEx(key, "version")[0]
+        else:
+            chrome_bin = os.getenv("CHROME_BIN", "google-chrome")
+            result = subprocess.run([chrome_bin, "--version"], capture_output=True, text=True, timeout=10)
+            version = result.stdout.strip().split()[-1]
+        return version.split(".")[0]
+    except Exception as e:
+        logger.warning(f"Could not determine local Chrome version: {str(e)}")
+        return None
+
+def resolve_chrome_driver_version(driver_dir, major):
+    """
+    Look up the Chrome for Testing version for the given Chrome major version
+    (or the newest milestone if major is None). The version list is cached in
+    driver_dir and revalidated with its ETag, so an unchanged list costs a 304.
+    """
+    api_url = "https://googlechromelabs.github.io/chrome-for-testing/latest-versions-per-milestone.json"
+    cache_path = os.path.join(driver_dir, "versions.json")
+    etag_path = os.path.join(driver_dir, ".etag")
+
+    headers = {}
+    if os.path.exists(cache_path) and os.path.exists(etag_path):
+        with open(etag_path, encoding='utf-8') as f:
+            headers['If-None-Match'] = f.read().strip()
+
+    response = _HTTP.get(api_url, headers=headers)
+    if response.status_code == 304:
+        logger.info("Chrome driver version list unchanged, using cached copy")
+        with open(cache_path, encoding='utf-8') as f:
+            driver_data = json.load(f)
+    else:
+        response.raise_for_status()  # Raise exception for HTTP errors
+        driver_data = response.json()
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(driver_data, f)
+        if response.headers.get('ETag'):
+            with open(etag_path, 'w', encoding='utf-8') as f:
+                f.write(response.headers['ETag'])
+
+    milestones = driver_data["milestones"]
+    if major is None:
+        major = max(milestones, key=int)
+    return milestones[major]["version"]
+
 def get_chrome_driver_path():
     """
     Download the correct Chrome driver using Chrome for Testing API.
-    This ensures compatibility with the installed Chrome browser.
+    The driver is cached per Chrome major version, so it is only downloaded
+    again when the installed Chrome browser is upgraded.
     """
     # Create driver directory if it doesn't exist
-    driver_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "drivers")
+    driver_dir = os.path.join(SCRIPT_DIR, "drivers")
     os.makedirs(driver_dir, exist_ok=True)
     
-    driver_path = os.path.join(driver_dir, "chromedriver.exe")
+    major = get_chrome_major_version()
+    driver_name = f"chromedriver-{major}.exe" if major else "chromedriver.exe"
+    driver_path = os.path.join(driver_dir, driver_name)
     
     # If driver already exists, return its path
     if os.path.exists(driver_path):
@@ -87,60 +244,86 @@ def get_chrome_driver_path():
         return driver_path
     
     try:
-        # Get the latest Chrome driver info from Chrome for Testing
-        logger.info("Getting latest Chrome driver version information...")
-        api_url = "https://googlechromelabs.github.io/chrome-for-testing/last-known-good-versions.json"
-        response = requests.get(api_url)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        driver_data = response.json()
-        
-        # Get the stable version info
-        stable_version = driver_data["channels"]["Stable"]["version"]
-        logger.info(f"Latest stable Chrome version: {stable_version}")
+        logger.info("Getting Chrome driver version information...")
+        version = resolve_chrome_driver_version(driver_dir, major)
+        logger.info(f"Chrome driver version for Chrome {major or 'latest'}: {version}")
         
         # Download the driver
-        logger.info(f"Downloading Chrome driver for version {stable_version}...")
-        download_url = f"https://storage.googleapis.com/chrome-for-testing-public/{stable_version}/win64/chromedriver-win64.zip"
-        response = requests.get(download_url)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Extract the zip file
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-            # Extract all files from the zip
-            zip_file.extractall(driver_dir)
+        logger.info(f"Downloading Chrome driver for version {version}...")
+        download_url = f"https://storage.googleapis.com/chrome-for-testing-public/{version}/win64/chromedriver-win64.zip"
+        # Stream the archive to disk in 1 MB chunks. A SpooledTemporaryFile
+        # would avoid the disk, but zipfile rejects it before Python 3.11.
+        with _HTTP.get(download_url, stream=True) as response, \
+                tempfile.TemporaryFile() as archive:
+            response.raise_for_status()  # Raise exception for HTTP errors
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                archive.write(chunk)
+            archive.seek(0)
+            
+            # Extract chromedriver.exe straight to its final path
+            with zipfile.ZipFile(archive) as zip_file:
+                member = "chromedriver-win64/chromedriver.exe"
+                if member not in zip_file.namelist():
+                    logger.error(f"Could not find chromedriver.exe in downloaded archive")
+                    return None
+                tmp_path = driver_path + ".part"
+                with zip_file.open(member) as src, open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp_path, driver_path)
         
-        # Move the chromedriver.exe from the extracted folder to drivers directory
-        extracted_driver = os.path.join(driver_dir, "chromedriver-win64", "chromedriver.exe")
-        if os.path.exists(extracted_driver):
-            shutil.copy(extracted_driver, driver_path)
-            logger.info(f"Chrome driver downloaded and installed at {driver_path}")
-            return driver_path
-        else:
-            logger.error(f"Could not find chromedriver.exe in extracted files")
-            return None
-    except Exception as e:
-        logger.error(f"Failed to download Chrome driver: {str(e)}")
+        logger.info(f"Chrome driver downloaded and installed at {driver_path}")
+        return driver_path
+    except Exception:
+        logger.exception("Failed to download Chrome driver")
         return None
 
-def initialize_driver():
-    """Initialize and return the Chrome webdriver."""
+def resolve_driver_path():
+    """
+    Return the chromedriver path to use: CHROMEDRIVER_PATH (or CHROMEDRIVER) if
+    set, else our cached download, falling back to ChromeDriverManager. Resolve
+    once and share across workers.
+    """
+    # A pre-installed chromedriver (the Docker image sets CHROMEDRIVER_PATH)
+    # skips the version lookup and any download
+    env_var = next((name for name in ("CHROMEDRIVER_PATH", "CHROMEDRIVER") if os.getenv(name)), None)
+    if env_var:
+        pinned_path = os.getenv(env_var)
+        if not os.path.exists(pinned_path):
+            raise FileNotFoundError(f"{env_var} points to a missing file: {pinned_path}")
+        logger.info(f"Using pinned Chrome driver at: {pinned_path}")
+        return pinned_path
+
+    # Try to get manually downloaded driver first
+    driver_path = get_chrome_driver_path()
+    if driver_path and os.path.exists(driver_path):
+        logger.info(f"Using Chrome driver at: {driver_path}")
+        return driver_path
+    # This fallback should only happen if our manual download failed completely
+    logger.warning("Manual driver download failed, using ChromeDriverManager")
+    # Imported here so normal runs don't load webdriver_manager at all
+    from webdriver_manager.chrome import ChromeDriverManager
+    return ChromeDriverManager(version="stable").install()
+
+def initialize_driver(worker_id=0, driver_path=None):
+    """
+    Initialize and return the Chrome webdriver for the given worker. Pass the
+    result of resolve_driver_path() as driver_path to skip resolving it again.
+    """
     try:
-        chrome_options, download_dir = setup_chrome_options()
-        
-        # Try to get manually downloaded driver first
-        driver_path = get_chrome_driver_path()
-        
-        if driver_path and os.path.exists(driver_path):
-            service = Service(executable_path=driver_path)
-            logger.info(f"Using Chrome driver at: {driver_path}")
-        else:
-            # This fallback should only happen if our manual download failed completely
-            logger.warning("Manual driver download failed, using ChromeDriverManager")
-            service = Service(ChromeDriverManager(version="stable").install())
+        chrome_options, download_dir = _with_download_dir(
+            _base_options(),
+            os.path.join(DOWNLOADS_DIR, f"worker-{worker_id}"),
+            f".chrome-profile-{worker_id}",
+        )
+        service = Service(executable_path=driver_path or resolve_driver_path())
             
         logger.info("Initializing Chrome driver...")
         driver = webdriver.Chrome(service=service, options=chrome_options)
         driver.set_page_load_timeout(30)
+        driver.set_script_timeout(30)
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': LOADER_JS})
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
         logger.info("Chrome driver initialized successfully")
         return driver, download_dir
     except Exception as e:
@@ -150,99 +333,153 @@ def initialize_driver():
 # ---------------------------------------------
 # HELPER FUNCTIONS
 # ---------------------------------------------
-def wait_and_find_element(driver, by, value, timeout=15):
-    """Wait for an element to be present and return it."""
-    try:
-        time.sleep(2)  # Adding a small delay for better visibility
-        element = WebDriverWait(driver, timeout, poll_frequency=0.5).until(
-            EC.presence_of_element_located((by, value))
-        )
-        # Scroll element into view
-        driver.execute_script("arguments[0].scrollIntoView(true);", element)
-        time.sleep(0.5)  # Wait for scroll
-        return element
-    except TimeoutException:
-        logger.error(f"Element not found: {value}")
-        raise
+async def _run(fn, *args, **kwargs):
+    """Run a blocking Selenium call in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+def _backoff(attempt):
+    """Delay before retry number attempt (from 0): doubles from the poll interval up to the retry delay."""
+    return min(SLEEP_PROFILE['retry'], SLEEP_PROFILE['poll'] * 2 ** attempt)
+
+# Locators and injected scripts reused on every expediente
+INPUT_LOC = (By.CSS_SELECTOR, 'input.z-textbox:not([style*="display:none"])')
+SEARCH_BTN_LOC = (By.CSS_SELECTOR, 'button[title="Buscar"]')
+LIMPIAR_BTN_LOC = (By.XPATH, "//button[contains(text(), 'Limpiar')]")
+MODAL_LOC = (By.CSS_SELECTOR, ".z-window-modal")
+RESULT_ROW_LOC = (By.CSS_SELECTOR, "tr.z-listitem")
+USER_FIELD_LOC = (By.CSS_SELECTOR, "[placeholder='Usuario/Cuil/Cuit']")
+PASSWORD_FIELD_LOC = (By.CSS_SELECTOR, "input[type='password']")
+LOGIN_BTN_LOC = (By.XPATH, "//button[contains(.,'Acceder')]")
+HOME_LOC = (By.CSS_SELECTOR, ".glyphicon-th")
+LOGIN_OR_HOME_LOC = (By.CSS_SELECTOR, "[placeholder='Usuario/Cuil/Cuit'], .glyphicon-th")
+DOWNLOAD_ALL_LOC = (By.XPATH, ".//button[contains(text(), 'Descargar todos los Documentos')]")
+# Scrolls the element into view and clicks it in one round trip
+CLICK_JS = "arguments[0].scrollIntoView({block: 'center'}); arguments[0].click();"
+LOADING_IDLE_JS = "return window.__loadingIdle === true;"
+INPUT_VALUE_JS = "return arguments[0].value;"
+NOTIFICATION_TEXTS_JS = (
+    "return Array.from(document.getElementsByClassName('z-notification-content'), e => e.textContent);"
+)
+# Notification shown when Buscar is clicked with an empty search input
+VALIDATION_ERROR_TEXT = "debe ingresar un valor"
+# Empties every text input, including the search input (#textInput), in one pass
+# and returns whatever the search input still holds. input/change events are
+# fired on the inputs that changed so ZK syncs the cleared value.
+RESET_INPUTS_JS = """
+var inputs = document.getElementsByTagName('input');
+for (var i = 0; i < inputs.length; i++) {
+    var el = inputs[i];
+    if ((el.type === 'text' || el.id === 'textInput') && el.value !== '') {
+        el.value = '';
+        el.dispatchEvent(new Event('input', { bubbles: true }));
+        el.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+}
+var searchInput = document.getElementById('textInput');
+return searchInput ? searchInput.value : '';
+"""
 
 def type_into_field(driver, element, text):
     """Type text into a field using JavaScript and direct input."""
     try:
-        # Clear using JavaScript
-        driver.execute_script("arguments[0].value = '';", element)
-        time.sleep(0.5)
-        
-        # Type using JavaScript
-        driver.execute_script(f"arguments[0].value = '{text}';", element)
-        time.sleep(0.5)
-        
-        # Trigger input event
-        driver.execute_script("arguments[0].dispatchEvent(new Event('input', { bubbles: true }));", element)
-        time.sleep(0.5)
-        
-        # Also try direct sendKeys as backup
-        element.send_keys(text)
-        time.sleep(0.5)
+        # Clear, set and fire the input event in one call; text is passed as an
+        # argument so quotes or backslashes in it need no escaping
+        actual_value = driver.execute_script(
+            "var e = arguments[0], v = arguments[1];"
+            "e.value = ''; e.value = v;"
+            "e.dispatchEvent(new Event('input', { bubbles: true }));"
+            "return e.value;",
+            element, text
+        )
         
         # Verify the text was entered
-        actual_value = driver.execute_script("return arguments[0].value;", element)
         if actual_value != text:
             logger.warning(f"Text verification failed. Expected: {text}, Got: {actual_value}")
             # One more attempt with direct sendKeys
             element.clear()
-            time.sleep(0.5)
             element.send_keys(text)
-            time.sleep(0.5)
     except Exception as e:
         logger.error(f"Error typing into field: {str(e)}")
         raise
 
-def check_for_loading(driver):
-    """Wait for any loading indicators to disappear."""
-    WebDriverWait(driver, 10, poll_frequency=0.2).until(
-        lambda d: all(
-            'display: none' in indicator.get_attribute('style')
-            for indicator in d.find_elements(By.CLASS_NAME, "z-loading")
-            if indicator.is_displayed()
-        )
+# Page state gathered in a single browser-side pass: login form shown (session
+# expired), a ZK loading indicator visible, a modal window open, a notification shown.
+STATE_JS = """
+return {
+    login: !!document.querySelector("[placeholder='Usuario/Cuil/Cuit']"),
+    loading: Array.from(document.querySelectorAll('.z-loading')).some(
+        e => e.offsetParent !== null && !e.style.display.includes('none')),
+    modal: !!document.querySelector('.z-window-modal'),
+    notification: !!document.querySelector('.z-notification-content')
+};
+"""
+
+def page_mentions(driver, *words):
+    """Return the subset of `words` found in the page text, checked in the browser."""
+    found = driver.execute_script(
+        "var text = document.body.innerText.toLowerCase();"
+        "return arguments[0].filter(function(w) { return text.includes(w); });",
+        list(words)
+    )
+    return set(found)
+
+def wait_for_page_ready(driver, timeout=15):
+    """Wait for the current document to finish loading after a refresh or navigation."""
+    WebDriverWait(driver, timeout, poll_frequency=SLEEP_PROFILE['poll']).until(
+        lambda d: d.execute_script("return document.readyState") == "complete"
+    )
+
+def _probe(driver):
+    """Return the current page state dict (login/loading/modal/notification) in one round trip."""
+    return driver.execute_script(STATE_JS)
+
+def check_for_loading(driver, timeout=10):
+    """
+    Wait for any loading indicators to disappear. Reads the flag LOADER_JS keeps
+    up to date, so each poll is a single boolean round trip.
+    """
+    WebDriverWait(driver, timeout, poll_frequency=SLEEP_PROFILE['poll']).until(
+        lambda d: d.execute_script(LOADING_IDLE_JS)
     )
 
 def check_session_expired(driver):
     """Return True if login fields are visible (session expired)."""
-    return bool(driver.find_elements(By.CSS_SELECTOR, "[placeholder='Usuario/Cuil/Cuit']"))
+    return _probe(driver)['login']
 
 def handle_login(driver):
     """Perform login with retries."""
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            username_field = wait_and_find_element(driver, By.CSS_SELECTOR, "[placeholder='Usuario/Cuil/Cuit']", timeout=15)
-            time.sleep(1)
+            wait = WebDriverWait(driver, 15, poll_frequency=SLEEP_PROFILE['poll'])
+            username_field = wait.until(
+                EC.element_to_be_clickable(USER_FIELD_LOC)
+            )
             username_field.clear()
-            user = os.getenv("USERNAME")
-            username_field.send_keys(user)
+            username_field.send_keys(GDE_USER)
             logger.info("Username entered")
 
-            password_field = wait_and_find_element(driver, By.CSS_SELECTOR, "input[type='password']", timeout=15)
-            time.sleep(1)
+            password_field = wait.until(
+                EC.element_to_be_clickable(PASSWORD_FIELD_LOC)
+            )
             password_field.clear()
-            password = os.getenv("PASSWORD")
-            password_field.send_keys(password)
+            password_field.send_keys(GDE_PASS)
             logger.info("Password entered")
 
-            login_button = wait_and_find_element(driver, By.XPATH, "//button[contains(.,'Acceder')]", timeout=15)
-            time.sleep(1)
+            login_button = wait.until(
+                EC.element_to_be_clickable(LOGIN_BTN_LOC)
+            )
             login_button.click()
             logger.info("Login button clicked")
             WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".glyphicon-th"))
+                EC.presence_of_element_located(HOME_LOC)
             )
             return
         except Exception as e:
             logger.error(f"Login attempt {attempt+1} failed: {str(e)}")
             if attempt < max_retries - 1:
                 driver.refresh()
-                time.sleep(3)
+                time.sleep(_backoff(attempt))
             else:
                 raise Exception("Failed to login after multiple attempts")
 
@@ -267,13 +504,13 @@ def reapply_navigation(driver):
             submit = driver.find_element(By.CSS_SELECTOR, "input[type='submit']")
             
             # Fill login form
-            username.send_keys(os.environ.get("GDE_USERNAME", ""))
-            password.send_keys(os.environ.get("GDE_PASSWORD", ""))
+            username.send_keys(GDE_USER)
+            password.send_keys(GDE_PASS)
             submit.click()
             
-            # Wait for login to complete - don't look for specific elements,
-            # just wait for the page to load and stabilize
-            time.sleep(5)
+            # Wait for login to complete: the login form is replaced by the next page
+            WebDriverWait(driver, 15, poll_frequency=SLEEP_PROFILE['poll']).until(EC.staleness_of(submit))
+            wait_for_page_ready(driver)
             logger.info("Successfully logged in after page refresh")
             
         except TimeoutException:
@@ -290,11 +527,8 @@ def reapply_navigation(driver):
             logger.info("Clicked 'Consulta de expediente' link")
             
             # Wait for the search page to load
-            time.sleep(3)
-            
-            # Check if we reached the search page
             try:
-                WebDriverWait(driver, 5).until(
+                WebDriverWait(driver, 10, poll_frequency=SLEEP_PROFILE['poll']).until(
                     EC.presence_of_element_located((By.ID, "textInput"))
                 )
                 logger.info("Successfully navigated to search page")
@@ -315,23 +549,24 @@ def reapply_navigation(driver):
             logger.warning("No text input field found")
         
         # Take a screenshot for debugging
-        try:
-            screenshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "current_page.png")
-            driver.save_screenshot(screenshot_path)
-            logger.info(f"Current page screenshot saved to {screenshot_path}")
-        except:
-            pass
+        if DEBUG_SCREENSHOTS:
+            try:
+                screenshot_path = os.path.join(SCRIPT_DIR, "current_page.png")
+                driver.save_screenshot(screenshot_path)
+                logger.info(f"Current page screenshot saved to {screenshot_path}")
+            except:
+                pass
             
-        # Last resort - check various elements that might indicate what page we're on
-        page_source = driver.page_source.lower()
-        if "expediente" in page_source:
+        # Last resort - check various words that might indicate what page we're on
+        mentions = page_mentions(driver, "expediente", "error", "invalidar")
+        if "expediente" in mentions:
             logger.info("Page contains 'expediente', may be on correct page")
             return True
-        elif "error" in page_source or "invalidar" in page_source:
+        elif "error" in mentions or "invalidar" in mentions:
             logger.warning("Page may contain error or session invalidation message")
             # Try to refresh the page
             driver.refresh()
-            time.sleep(5)
+            wait_for_page_ready(driver)
         
         logger.info("Navigation reapplied with fallback approach")
         return True  # We'll continue with the process even if navigation is uncertain
@@ -339,12 +574,13 @@ def reapply_navigation(driver):
     except Exception as e:
         logger.error(f"Error in reapply_navigation: {e}")
         # Take a screenshot to debug
-        try:
-            screenshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "navigation_error.png")
-            driver.save_screenshot(screenshot_path)
-            logger.info(f"Screenshot saved to {screenshot_path}")
-        except:
-            pass
+        if DEBUG_SCREENSHOTS:
+            try:
+                screenshot_path = os.path.join(SCRIPT_DIR, "navigation_error.png")
+                driver.save_screenshot(screenshot_path)
+                logger.info(f"Screenshot saved to {screenshot_path}")
+            except:
+                pass
         # Don't raise the exception - let the script continue
         return False
 
@@ -356,218 +592,422 @@ def check_and_relogin(driver):
         logger.info("Session expired detected. Re-logging in.")
         handle_login(driver)
         if not reapply_navigation(driver):
-            logger.warning(f"Failed to reapply navigation after session expired for expediente {expediente}")
+            logger.warning("Failed to reapply navigation after session expired")
             # Try to continue anyway
         return True
     return False
 
 def wait_for_single_result(driver, timeout=10):
     """
-    Wait for exactly one row in the results table.
+    Wait for exactly one row in the results table and return it.
     """
-    WebDriverWait(driver, timeout, poll_frequency=0.2).until(
-        lambda d: len(d.find_elements(By.XPATH, "//tr[contains(@class, 'z-listitem')]")) == 1
-    )
+    def single_row(d):
+        rows = d.find_elements(*RESULT_ROW_LOC)
+        return rows[0] if len(rows) == 1 else False
 
-def click_visualizar_option(driver, expediente, max_retries=3):
+    return WebDriverWait(driver, timeout, poll_frequency=SLEEP_PROFILE['poll']).until(single_row)
+
+def wait_for_search_response(driver, old_row, timeout=20):
+    """
+    Wait until the server has answered a search: the row shown before the
+    search (old_row, or None if there was none) has been replaced, or a
+    validation notification is shown. ZK only shows its loading mask after a
+    delay, so the mask alone does not tell us the response has arrived.
+    """
+    def responded(d):
+        # A validation notification is also an answer to the search
+        if any(VALIDATION_ERROR_TEXT in msg.lower() for msg in d.execute_script(NOTIFICATION_TEXTS_JS)):
+            return True
+        if old_row is not None:
+            return EC.staleness_of(old_row)(d)
+        return bool(d.find_elements(*RESULT_ROW_LOC))
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=SLEEP_PROFILE['poll']).until(responded)
+    except TimeoutException:
+        logger.warning("Results table did not change after the search")
+
+# The "Visualizar" item of the open combobox popup, located in a single lookup
+VISUALIZAR_XPATH = (
+    "//div[contains(@class,'z-combobox-popup') and not(contains(@style,'display: none'))]"
+    "//li[contains(@class,'z-comboitem')]//span[normalize-space(.)='Visualizar']"
+)
+
+# Opens the result row's combobox and clicks its "Visualizar" item in one
+# round trip. The row element is optional; without it the first result row is
+# looked up. Calls back with null on success or an error string.
+VISUALIZAR_JS = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[0];
+var optionXPath = arguments[1];
+var row = arguments[2];
+var finished = false;
+function finish(result) {
+    if (finished) return;
+    finished = true;
+    done(result);
+}
+var button = row ? row.querySelector('a.z-combobox-button')
+                 : document.querySelector('tr.z-listitem a.z-combobox-button');
+if (!button) { finish('Combo button not found in result row'); return; }
+button.scrollIntoView(true);
+button.click();
+
+// Only click an option that is rendered (no display:none on it or an
+// ancestor) and not disabled, as element_to_be_clickable would
+function selectOption() {
+    var matches = document.evaluate(
+        optionXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = 0; i < matches.snapshotLength; i++) {
+        var option = matches.snapshotItem(i);
+        var item = option.closest('li');
+        if (option.offsetParent === null) continue;
+        if (item && (item.classList.contains('z-comboitem-disabled') || item.getAttribute('aria-disabled') === 'true')) continue;
+        option.click();
+        return true;
+    }
+    return false;
+}
+if (selectOption()) { finish(null); return; }
+var observer = new MutationObserver(check);
+var poll = setInterval(check, 100);
+function stop() { observer.disconnect(); clearInterval(poll); }
+function check() {
+    if (!finished && selectOption()) { stop(); finish(null); }
+}
+observer.observe(document.body, {subtree: true, childList: true, attributes: true, attributeFilter: ['style', 'class']});
+setTimeout(function() { stop(); finish("'Visualizar' option did not appear"); }, timeoutMs);
+"""
+
+def click_visualizar_option(driver, expediente, row=None, max_retries=3):
     """
     Click the combobox button in the result row and select "Visualizar."
+    Pass the row returned by wait_for_single_result to skip looking it up again.
     """
     for attempt in range(max_retries):
         try:
             check_for_loading(driver)
-            row = driver.find_element(By.XPATH, "//tr[contains(@class, 'z-listitem')]")
-            combo_btn = row.find_element(By.CSS_SELECTOR, "a.z-combobox-button")
-            driver.execute_script("arguments[0].scrollIntoView(true);", combo_btn)
-            driver.execute_script("arguments[0].click();", combo_btn)
-            time.sleep(0.7)
-            visualizar_option = WebDriverWait(driver, 20, poll_frequency=0.2).until(
-                EC.element_to_be_clickable(
-                    (By.XPATH, "//div[contains(@class, 'z-combobox-popup') and not(contains(@style, 'display: none'))]"
-                               "//li[contains(@class, 'z-comboitem')]//span[contains(text(), 'Visualizar')]"))
-            )
-            driver.execute_script("arguments[0].click();", visualizar_option)
-            time.sleep(0.7)
+            error = driver.execute_async_script(VISUALIZAR_JS, 20000, VISUALIZAR_XPATH, row)
+            if error:
+                raise Exception(error)
             return
         except StaleElementReferenceException as e:
             logger.warning(f"Stale element on combo for {expediente}, attempt {attempt+1}: {str(e)}")
-            time.sleep(1)
+            row = None  # ZK re-rendered the row; look it up again in the page
         except Exception as e:
             logger.warning(f"Combo box attempt {attempt+1}/{max_retries} for {expediente} failed: {str(e)}")
-            time.sleep(1)
     raise Exception(f"Failed to select 'Visualizar' for expediente {expediente} after {max_retries} retries")
 
-async def wait_for_download_with_verification(driver, download_dir, expediente, timeout=90):
+def _normalize(text):
+    """Remove all whitespace from text."""
+    return "".join(text.split())
+
+def expediente_pattern(expediente):
+    """
+    Compile a regex matching the expediente in a whitespace-stripped filename.
+    Accepts the plain, '#'->'%' encoded and '%'-stripped forms.
+    """
+    normalized_expediente = _normalize(expediente)
+    encoded = normalized_expediente.replace('#', '%')
+    return re.compile("|".join(
+        re.escape(v) for v in {normalized_expediente, encoded, encoded.replace('%', '')}
+    ))
+
+def _match_expediente(pattern, filename):
+    """Return True if filename is a finished download matching the expediente pattern."""
+    if filename.endswith('.crdownload') or filename.endswith('.tmp'):
+        return False
+    return pattern.search(_normalize(filename)) is not None
+
+# Returns the text of the first visible ZK error message box after clicking its
+# visible buttons to dismiss it, or null when no error is shown
+DOWNLOAD_ERROR_JS = """
+var visible = function(e) { return e.offsetParent !== null; };
+var error = Array.from(document.getElementsByClassName('z-messagebox-error')).find(visible);
+if (!error) return null;
+Array.from(document.getElementsByClassName('z-messagebox-button')).filter(visible)
+    .forEach(function(b) { b.click(); });
+return error.innerText;
+"""
+
+def check_download_error(driver):
+    """
+    Return the text of a visible ZK error message box (dismissing it), or None.
+    """
+    try:
+        error_text = driver.execute_script(DOWNLOAD_ERROR_JS)
+        if error_text is not None:
+            logger.warning(f"Error message displayed: {error_text}")
+            logger.info("Dismissed error message")
+        return error_text
+    except Exception:
+        pass  # Ignore errors checking for error messages
+    return None
+
+class DownloadEventHandler(PatternMatchingEventHandler):
+    """
+    Watchdog handler that sets an asyncio.Event once a finished (non-temporary)
+    file whose name matches the expediente pattern appears in the watched directory.
+    """
+
+    def __init__(self, pattern, loop, event):
+        super().__init__(patterns=['*'], ignore_patterns=['*.crdownload', '*.tmp'], ignore_directories=True)
+        self.pattern = pattern
+        self.loop = loop
+        self.event = event
+        self.matched = None
+
+    def _check(self, path):
+        name = os.path.basename(path)
+        if _match_expediente(self.pattern, name):
+            self.matched = name
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def on_created(self, event):
+        self._check(event.src_path)
+
+    def on_moved(self, event):
+        # Chrome renames <name>.crdownload to <name> when the download finishes
+        self._check(event.dest_path)
+
+# One filesystem observer shared by all workers, started on first use
+_observer = Observer()
+
+def _ensure_observer():
+    if not _observer.is_alive():
+        _observer.start()
+
+async def wait_for_download_with_verification(driver, download_dir, expediente, timeout=DOWNLOAD_TIMEOUT, trigger=None):
     """
     Wait for a download to complete and verify the downloaded file.
+    Completion is signalled by filesystem events rather than polling the directory.
+    `trigger` is an optional coroutine function that starts the download; it is
+    awaited once the directory is being watched, so a fast download cannot finish
+    unseen, and its errors propagate to the caller.
     Returns (True, None) on success or (False, error_message) on failure.
     """
-    normalized_expediente = "".join(expediente.split())
-    start_time = time.time()
-    completed_time = None
-    
+    # Files modified before this instant belong to earlier downloads
+    start_ns = time.time_ns()
+    pattern = expediente_pattern(expediente)
+    done = asyncio.Event()
+    handler = DownloadEventHandler(pattern, asyncio.get_running_loop(), done)
+    _ensure_observer()
+    watch = _observer.schedule(handler, download_dir, recursive=False)
+
     try:
-        # Get initial file list
-        initial_files = set(os.listdir(download_dir))
-        
-        # Set up polling interval
-        poll_interval = 1.0  # seconds
-        
-        # Wait for download to complete
-        while time.time() - start_time < timeout:
-            # Wait for a moment
-            await asyncio.sleep(poll_interval)
-            
+        if trigger is not None:
+            await trigger()
+        start_time = time.time()
+
+        try:
+            # Wait for the download event, checking the UI for error messages in between
+            check_interval = 5  # seconds
+            info_on = logger.isEnabledFor(logging.INFO)
+            while time.time() - start_time < timeout:
+                remaining = timeout - (time.time() - start_time)
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=min(check_interval, remaining))
+                    logger.info("Download confirmed complete: %s", handler.matched)
+                    return True, None
+                except asyncio.TimeoutError:
+                    pass
+
+                if info_on:
+                    logger.info("Waiting for download to complete... (%d/%ds)", time.time() - start_time, timeout)
+
+                error_text = await _run(check_download_error, driver)
+                if error_text is not None:
+                    return False, f"Error message: {error_text}"
+
+            # Timeout reached, check one more time for matching files
             try:
-                # Get current file list
-                current_files = set(os.listdir(download_dir))
-                new_files = current_files - initial_files
-                
-                # Check for temp download files
-                temp_files = [f for f in new_files if f.endswith('.crdownload') or f.endswith('.tmp')]
-                
-                # Check for files matching the expediente
-                matching_files = []
-                for f in new_files:
-                    # Skip temporary files
-                    if f.endswith('.crdownload') or f.endswith('.tmp'):
-                        continue
-                        
-                    # Process filename for comparison
-                    file_for_comparison = f
-                    
-                    # Handle URL-encoded characters
-                    normalized_exp = normalized_expediente.replace('#', '%')
-                    
-                    # Try multiple matching methods
-                    if (normalized_exp in "".join(file_for_comparison.split()) or
-                        normalized_exp.replace('%', '') in "".join(file_for_comparison.split()) or
-                        normalized_expediente in "".join(file_for_comparison.split())):
-                        matching_files.append(f)
-                        
-                    # Also look for a match with spaces preserved
-                    elif (expediente.replace('#', '%') in file_for_comparison or
-                          expediente in file_for_comparison):
-                        matching_files.append(f)
-                
+                with os.scandir(download_dir) as it:
+                    matching_files = [
+                        e.name for e in it
+                        if _match_expediente(pattern, e.name) and e.stat().st_mtime_ns >= start_ns
+                    ]
+
                 if matching_files:
-                    # If we found a matching file and it's not temporary
-                    if not completed_time:
-                        completed_time = time.time()
-                        logger.info(f"Download appears complete, waiting to confirm: {matching_files}")
-                    elif time.time() - completed_time >= 2:
-                        logger.info(f"Download confirmed complete: {matching_files}")
-                        return True, None
-                else:
-                    # Reset completed_time if we detect in-progress downloads
-                    completed_time = None
-                    
-                # Log status periodically
-                elapsed = time.time() - start_time
-                if elapsed % 5 < poll_interval:
-                    if temp_files:
-                        logger.info(f"Download in progress... ({int(elapsed)}/{timeout}s)")
-                    elif new_files:
-                        logger.info(f"New files found but none match expediente: {new_files}")
-                    else:
-                        logger.info(f"Waiting for download to start... ({int(elapsed)}/{timeout}s)")
-                        
-                # Check for error messages in the UI
-                try:
-                    error_elements = driver.find_elements(By.CLASS_NAME, "z-messagebox-error")
-                    for element in error_elements:
-                        if element.is_displayed():
-                            error_text = element.text
-                            logger.warning(f"Error message displayed: {error_text}")
-                            # Try to dismiss error message
-                            dismiss_buttons = driver.find_elements(By.CSS_SELECTOR, ".z-messagebox-button")
-                            for button in dismiss_buttons:
-                                if button.is_displayed():
-                                    button.click()
-                                    logger.info("Dismissed error message")
-                            return False, f"Error message: {error_text}"
-                except Exception as e:
-                    pass  # Ignore errors checking for error messages
-                    
+                    logger.info(f"Found matching files after timeout: {matching_files}")
+                    return True, None
             except Exception as e:
-                logger.warning(f"Error checking download status: {str(e)}")
-        
-        # Timeout reached, check one more time for matching files
-        try:
-            current_files = set(os.listdir(download_dir))
-            new_files = current_files - initial_files
-            
-            # Use same enhanced matching as above
-            matching_files = []
-            for f in new_files:
-                # Skip temporary files
-                if f.endswith('.crdownload') or f.endswith('.tmp'):
-                    continue
-                    
-                # Process filename for comparison
-                file_for_comparison = f
-                
-                # Handle URL-encoded characters
-                normalized_exp = normalized_expediente.replace('#', '%')
-                
-                # Try multiple matching methods
-                if (normalized_exp in "".join(file_for_comparison.split()) or
-                    normalized_exp.replace('%', '') in "".join(file_for_comparison.split()) or
-                    normalized_expediente in "".join(file_for_comparison.split())):
-                    matching_files.append(f)
-                    
-                # Also look for a match with spaces preserved
-                elif (expediente.replace('#', '%') in file_for_comparison or
-                      expediente in file_for_comparison):
-                    matching_files.append(f)
-            
-            if matching_files:
-                logger.info(f"Found matching files after timeout: {matching_files}")
-                return True, None
+                logger.error(f"Error logging final directory state: {str(e)}")
+
+            return False, "Download timed out"
         except Exception as e:
-            logger.error(f"Error logging final directory state: {str(e)}")
-        
-        return False, "Download timed out"
-    except Exception as e:
-        logger.error(f"Error in wait_for_download: {str(e)}")
-        return False, f"Download error: {str(e)}"
+            logger.error(f"Error in wait_for_download: {str(e)}")
+            return False, f"Download error: {str(e)}"
+    finally:
+        _observer.unschedule(watch)
+
+class TempFileTracker(PatternMatchingEventHandler):
+    """
+    Watchdog handler that tracks the temporary download files present in the
+    watched directories and sets an asyncio.Event whenever none are left.
+    """
+
+    def __init__(self, loop, event):
+        super().__init__(patterns=['*.crdownload', '*.tmp'], ignore_directories=True)
+        self.loop = loop
+        self.event = event
+        self.pending = set()
+
+    def _update(self, add=None, remove=None):
+        # Runs on the event loop thread, so the set needs no lock
+        if add:
+            self.pending.add(add)
+        if remove:
+            self.pending.discard(remove)
+        if self.pending:
+            self.event.clear()
+        else:
+            self.event.set()
+
+    def on_created(self, event):
+        self.loop.call_soon_threadsafe(self._update, event.src_path, None)
+
+    def on_deleted(self, event):
+        self.loop.call_soon_threadsafe(self._update, None, event.src_path)
+
+    def on_moved(self, event):
+        # Chrome renames "Unconfirmed N.crdownload" to <name>.crdownload while
+        # still downloading, and <name>.crdownload to <name> once it finishes
+        dest = event.dest_path
+        add = dest if dest.endswith(('.crdownload', '.tmp')) else None
+        self.loop.call_soon_threadsafe(self._update, add, event.src_path)
+
+async def wait_for_pending_downloads(directories, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Wait until no temporary download files remain in directories. The
+    directories are scanned once; after that only watchdog events update the
+    set of pending files. Returns True if they all finished.
+    """
+    finished = asyncio.Event()
+    tracker = TempFileTracker(asyncio.get_running_loop(), finished)
+    _ensure_observer()
+    watches = [_observer.schedule(tracker, directory, recursive=False) for directory in directories]
+    try:
+        for directory in directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(('.crdownload', '.tmp')):
+                        tracker.pending.add(entry.path)
+        tracker._update()
+        try:
+            await asyncio.wait_for(finished.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out waiting for pending downloads: {sorted(tracker.pending)}")
+            return False
+    finally:
+        for watch in watches:
+            _observer.unschedule(watch)
+
+def click_download_button(driver):
+    """Wait for the Visualizar modal and click 'Descargar todos los Documentos'."""
+    modal = WebDriverWait(driver, 15, poll_frequency=SLEEP_PROFILE['poll']).until(
+        EC.presence_of_element_located(MODAL_LOC)
+    )
+    download_button = WebDriverWait(modal, 5, poll_frequency=SLEEP_PROFILE['poll']).until(
+        EC.element_to_be_clickable(DOWNLOAD_ALL_LOC)
+    )
+    
+    driver.execute_script(CLICK_JS, download_button)
+
+def _press_escape(driver):
+    """Press Escape through CDP; needs no element lookup."""
+    for event_type in ('keyDown', 'keyUp'):
+        driver.execute_cdp_cmd('Input.dispatchKeyEvent', {
+            'type': event_type, 'windowsVirtualKeyCode': 27, 'key': 'Escape', 'code': 'Escape'
+        })
+
+def close_modal(driver, expediente):
+    """
+    Close the Visualizar modal after a download: press Escape, then remove the
+    modal from the DOM if it persists, and only reload the page if that fails.
+    """
+    try:
+        _press_escape(driver)
+        try:
+            WebDriverWait(driver, 2, poll_frequency=0.1).until(lambda d: not _probe(d)['modal'])
+            logger.info("Confirmed modal is closed")
+            return
+        except TimeoutException:
+            logger.warning("Modal still present after Escape, using DOM removal")
+
+        # Use JS to remove all modals
+        driver.execute_script("""
+            // Remove all modal-related elements; the live collections shrink as nodes go
+            for (const cls of ['z-window-modal', 'z-modal-mask']) {
+                const c = document.getElementsByClassName(cls);
+                while (c.length) c[0].remove();
+            }
+
+            // For ZK framework, try more aggressive cleanup
+            if (window.zk) {
+                try {
+                    zk.Widget.$(document.body).children.forEach(function(w) {
+                        if (w.$instanceof(zk.wnd.Window) && w.isVisible())
+                            w.close();
+                    });
+                } catch(e) {
+                    console.error('ZK cleanup error:', e);
+                }
+            }
+        """)
+        logger.info("Modal forcefully removed from DOM")
+
+    except Exception as close_err:
+        logger.warning(f"All modal closing attempts failed: {close_err}. Using most aggressive method")
+
+        # Scoped DOM reset first; a reload means re-fetching the page and re-navigating
+        try:
+            driver.execute_script("""
+                // Clear any modal or overlay elements
+                for (const cls of ['z-window-modal', 'z-modal-mask', 'z-window-shadow', 'z-window']) {
+                    const c = document.getElementsByClassName(cls);
+                    while (c.length) c[0].remove();
+                }
+
+                // Clear overlay styles and let ZK re-layout the page
+                document.documentElement.style.overflow = '';
+                document.body.style.overflow = '';
+                window.dispatchEvent(new Event('resize'));
+            """)
+            WebDriverWait(driver, 2, poll_frequency=0.1).until(EC.invisibility_of_element_located(MODAL_LOC))
+            logger.info("Overlays removed without reloading the page")
+            return
+        except Exception as reset_err:
+            logger.warning(f"DOM reset did not clear the modal: {reset_err}")
+
+        # Force page refresh as last resort
+        try:
+            # refresh() blocks until the new document loads, so the readiness
+            # check below cannot see the old page's readyState
+            driver.refresh()
+            logger.info("Reloaded page to clear modal state")
+            wait_for_page_ready(driver)
+            if not reapply_navigation(driver):
+                logger.warning(f"Failed to reapply navigation after refreshing page for expediente {expediente}")
+                # Try to continue anyway
+        except Exception as reload_err:
+            logger.warning(f"Error during page reload: {reload_err}")
+            pass
 
 async def handle_modal_download(driver, expediente, download_dir):
     """
     In the modal, click the download button, wait for the file,
     then close the modal. Returns (True, None) on success or (False, error_message) on failure.
     """
-    # Check if file already exists before downloading using normalized comparison
-    normalized_expediente = "".join(expediente.split())
-    existing_files = [f for f in os.listdir(download_dir) if normalized_expediente in "".join(f.split()) and not (f.endswith('.crdownload') or f.endswith('.tmp'))]
-    if existing_files:
-        logger.info(f"File for expediente {expediente} already exists: {existing_files}. Closing modal without downloading again.")
-        # Forcefully remove the modal element from the DOM using modern JavaScript
-        driver.execute_script("document.querySelector('.z-window-modal')?.remove();")
-        logger.info("Modal removed from DOM because file already exists.")
-        time.sleep(1)
-        return True, None
-
     max_modal_attempts = 3
     for attempt in range(max_modal_attempts):
         try:
-            # Wait for modal and download button
-            modal = WebDriverWait(driver, 15, poll_frequency=0.2).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "z-window-modal"))
-            )
-            download_button = WebDriverWait(modal, 5, poll_frequency=0.2).until(
-                EC.element_to_be_clickable((By.XPATH, ".//button[contains(text(), 'Descargar todos los Documentos')]"))
-            )
-            
-            # Ensure button is in view and click
-            driver.execute_script("arguments[0].scrollIntoView(true);", download_button)
-            time.sleep(0.5)
-            driver.execute_script("arguments[0].click();", download_button)
+            # Watch the download dir, then wait for the modal and click the download button
             logger.info(f"Starting download for expediente: {expediente}")
-            
-            # Wait for download with verification
-            logger.info(f"Waiting for download to complete for {expediente}")
-            download_success, error = await wait_for_download_with_verification(driver, download_dir, expediente)
+            download_success, error = await wait_for_download_with_verification(
+                driver, download_dir, expediente,
+                trigger=lambda: _run(click_download_button, driver)
+            )
             
             if not download_success:
                 logger.warning(f"Download failed: {error}")
@@ -577,113 +1017,16 @@ async def handle_modal_download(driver, expediente, download_dir):
             logger.info(f"Download successful for expediente {expediente}, closing modal")
             
             # Close modal after successful download
-            try:
-                # First try to click the close button using reliable class selectors
-                try:
-                    # Use the most reliable class-based selectors - avoid any ID-based selectors
-                    close_button = WebDriverWait(driver, 5).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, ".z-window-modal .z-window-icon.z-window-close"))
-                    )
-                    # Try JavaScript click which is more reliable
-                    driver.execute_script("arguments[0].click();", close_button)
-                    logger.info("Modal close button clicked with JavaScript")
-                    time.sleep(1)
-                except Exception as e:
-                    logger.warning(f"Could not click modal close button: {e}")
-                    
-                    # Try clicking the i tag inside the close button
-                    try:
-                        close_icon = WebDriverWait(driver, 3).until(
-                            EC.element_to_be_clickable((By.CSS_SELECTOR, ".z-window-modal .z-icon-times"))
-                        )
-                        driver.execute_script("arguments[0].click();", close_icon)
-                        logger.info("Modal close icon clicked with JavaScript")
-                        time.sleep(1)
-                    except Exception as e2:
-                        logger.warning(f"Could not click close icon: {e2}")
-                
-                # Check if modal is still present
-                try:
-                    modals = driver.find_elements(By.CLASS_NAME, "z-window-modal")
-                    if modals:
-                        logger.warning(f"Modal still present after clicking close button, using DOM removal")
-                        # Use JS to remove all modals
-                        driver.execute_script("""
-                            // Remove all modal-related elements
-                            document.querySelectorAll('.z-window-modal').forEach(el => el.parentNode.removeChild(el));
-                            document.querySelectorAll('.z-modal-mask').forEach(el => el.parentNode.removeChild(el));
-                            
-                            // For ZK framework, try more aggressive cleanup
-                            if (window.zk) {
-                                try {
-                                    zk.Widget.$(document.body).children.forEach(function(w) {
-                                        if (w.$instanceof(zk.wnd.Window) && w.isVisible())
-                                            w.close();
-                                    });
-                                } catch(e) {
-                                    console.error('ZK cleanup error:', e);
-                                }
-                            }
-                        """)
-                        logger.info("Modal forcefully removed from DOM")
-                except Exception as e3:
-                    logger.warning(f"Error checking/removing modal: {e3}")
-                
-                # Always send escape key as failsafe
-                try:
-                    ActionChains(driver).send_keys(webdriver.Keys.ESCAPE).perform()
-                    logger.info("Sent escape key to close modal")
-                except Exception as e4:
-                    logger.warning(f"Failed to send escape key: {e4}")
-                
-                # Verify the modal is actually gone
-                try:
-                    modal_gone = WebDriverWait(driver, 5).until_not(
-                        EC.presence_of_element_located((By.CLASS_NAME, "z-window-modal"))
-                    )
-                    if modal_gone:
-                        logger.info("Confirmed modal is closed")
-                    else:
-                        logger.warning("Modal may still be present after close attempts")
-                except:
-                    logger.warning("Could not verify if modal is closed")
-                
-            except Exception as close_err:
-                logger.warning(f"All modal closing attempts failed: {close_err}. Using most aggressive method")
-                
-                # Most aggressive approach: inject page-level reset code
-                driver.execute_script("""
-                    // Clear any modal or overlay elements
-                    document.querySelectorAll('.z-window-modal, .z-modal-mask, .z-window-shadow, .z-window').forEach(el => {
-                        if (el.parentNode) el.parentNode.removeChild(el);
-                    });
-                    
-                    // Clear overlay styles from body
-                    document.body.style.overflow = '';
-                    
-                    // Release any event handlers and reset UI state
-                    document.body.click();
-                    
-                    // Try to force garbage collection of event handlers
-                    setTimeout(function() { 
-                        if (window.gc) window.gc();
-                    }, 100);
-                """)
-                
-                # Force page refresh as last resort
-                try:
-                    driver.execute_script("location.reload();")
-                    logger.info("Reloaded page to clear modal state")
-                    time.sleep(3)
-                    if not reapply_navigation(driver):
-                        logger.warning(f"Failed to reapply navigation after refreshing page for expediente {expediente}")
-                        # Try to continue anyway
-                    time.sleep(2)
-                except Exception as reload_err:
-                    logger.warning(f"Error during page reload: {reload_err}")
-                    pass
+            await _run(close_modal, driver, expediente)
             
-            time.sleep(2)  # Extended wait for modal to fully close
+            # Make sure the modal is fully gone before the next search
+            try:
+                await _run(
+                    WebDriverWait(driver, 5, poll_frequency=SLEEP_PROFILE['poll']).until,
+                    EC.invisibility_of_element_located(MODAL_LOC)
+                )
+            except TimeoutException:
+                logger.warning("Modal still visible after closing")
             return True, None
             
         except Exception as e:
@@ -693,11 +1036,11 @@ async def handle_modal_download(driver, expediente, download_dir):
                 logger.error(error_msg)
                 # Try to force close the modal even on error
                 try:
-                    driver.execute_script("document.querySelector('.z-window-modal')?.remove();")
+                    await _run(driver.execute_script, "document.querySelector('.z-window-modal')?.remove();")
                 except:
                     pass
                 return False, error_msg
-            time.sleep(1)
+            await asyncio.sleep(_backoff(attempt))
     
     return False, "Max attempts exceeded"
 
@@ -707,123 +1050,94 @@ async def clear_search_state(driver):
     This prevents getting stuck in a loop with the same expediente.
     """
     logger.info("Clearing search state to prepare for next expediente")
-    
+
+    # Fast path: reset the inputs in the page, then check the search input is empty
     try:
-        # First try to find and click the "Limpiar" (Clear) button if present
-        try:
-            clear_button = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Limpiar')]"))
-            )
-            driver.execute_script("arguments[0].click();", clear_button)
-            logger.info("Clicked 'Limpiar' button to clear search")
-            await asyncio.sleep(1)
-            return True
-        except Exception as e:
-            logger.info(f"Limpiar button not found or not clickable: {e}")
-        
-        # Try to clear the input field directly
-        try:
-            search_input = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.ID, "textInput"))
-            )
-            # Clear the input field
-            search_input.clear()
-            # Also send ctrl+a and delete as a more thorough way to clear
-            search_input.send_keys(webdriver.Keys.CONTROL + "a")
-            search_input.send_keys(webdriver.Keys.DELETE)
-            logger.info("Cleared search input field directly")
-            await asyncio.sleep(1)
-            return True
-        except Exception as e:
-            logger.warning(f"Could not clear search input field: {e}")
-        
-        # If all else fails, use JavaScript to reset the input field
-        try:
-            driver.execute_script("""
-                // Reset the search input
-                var inputs = document.querySelectorAll('input[type="text"]');
-                for(var i=0; i<inputs.length; i++) {
-                    inputs[i].value = '';
-                }
-                
-                // Try to find specific search input by ID
-                var searchInput = document.getElementById('textInput');
-                if(searchInput) {
-                    searchInput.value = '';
-                }
-            """)
+        remaining = await _run(driver.execute_script, RESET_INPUTS_JS)
+        if not remaining:
             logger.info("Reset search input using JavaScript")
-            await asyncio.sleep(1)
             return True
-        except Exception as e:
-            logger.warning(f"JavaScript reset of search input failed: {e}")
-            
-        # Last resort: refresh the page, but this is expensive
+        logger.info(f"Search input still holds '{remaining}' after JavaScript reset")
+    except JavascriptException as e:
+        logger.warning(f"JavaScript reset of search input failed: {e}")
+
+    # Then the "Limpiar" (Clear) button; find_elements returns at once when it is absent
+    clear_buttons = await _run(driver.find_elements, *LIMPIAR_BTN_LOC)
+    if clear_buttons:
         try:
-            logger.warning("Using page refresh as last resort to clear search state")
-            driver.refresh()
-            time.sleep(3)
-            if not reapply_navigation(driver):
-                logger.warning("Failed to reapply navigation after page refresh in clear_search_state")
+            await _run(driver.execute_script, CLICK_JS, clear_buttons[0])
+            logger.info("Clicked 'Limpiar' button to clear search")
+            await _run(check_for_loading, driver, 5)
             return True
-        except Exception as e:
-            logger.error(f"Page refresh failed: {e}")
-            
-        return False
-    except Exception as e:
-        logger.error(f"Error in clear_search_state: {e}")
+        except (TimeoutException, StaleElementReferenceException) as e:
+            logger.info(f"Limpiar button click did not settle: {e}")
+
+    # Last resort: refresh the page, but this is expensive
+    try:
+        logger.warning("Using page refresh as last resort to clear search state")
+        await _run(driver.refresh)
+        await _run(wait_for_page_ready, driver)
+        if not await _run(reapply_navigation, driver):
+            logger.warning("Failed to reapply navigation after page refresh in clear_search_state")
+        return True
+    except WebDriverException as e:
+        logger.error(f"Page refresh failed: {e}")
         return False
 
 def type_and_search(driver, expediente, max_attempts=3):
     """Type text and click search with retry logic."""
-    input_selector = 'input.z-textbox:not([style*="display:none"])'
     for attempt in range(max_attempts):
         try:
-            time.sleep(5)  # Increased initial wait for page load
             try:
-                WebDriverWait(driver, 10).until_not(
-                    EC.presence_of_element_located((By.CLASS_NAME, "z-loading"))
-                )
+                check_for_loading(driver)
             except Exception:
                 pass
             # Always fetch a fresh input element
             gde_input = WebDriverWait(driver, 20).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, input_selector))
+                EC.element_to_be_clickable(INPUT_LOC)
             )
             # Inner loop to handle stale element issues during typing
+            current_value = None
             for inner_attempt in range(2):
                 try:
                     gde_input.click()
-                    time.sleep(1)
                     gde_input.clear()
-                    time.sleep(1)
                     gde_input.send_keys(expediente)
-                    time.sleep(2)
-                    if gde_input.get_attribute('value') == expediente:
+                    WebDriverWait(driver, 5, poll_frequency=SLEEP_PROFILE['poll']).until(
+                        EC.text_to_be_present_in_element_value(INPUT_LOC, expediente)
+                    )
+                    current_value = driver.execute_script(INPUT_VALUE_JS, gde_input)
+                    if current_value == expediente:
                         break  # Successfully entered text
                     else:
                         raise Exception("Text verification failed in inner loop")
                 except StaleElementReferenceException:
                     logger.info("Input field went stale during typing; re-finding element.")
-                    gde_input = driver.find_element(By.CSS_SELECTOR, input_selector)
-            if gde_input.get_attribute('value') != expediente:
-                raise Exception(f"Failed to enter text exactly. Expected: '{expediente}', Got: '{gde_input.get_attribute('value')}'")
+                    gde_input = driver.find_element(*INPUT_LOC)
+            if current_value != expediente:
+                raise Exception(f"Failed to enter text exactly. Expected: '{expediente}', Got: '{current_value}'")
             logger.info(f"Successfully typed '{expediente}' into search box")
             # Find and click search button
-            search_btn = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[title="Buscar"]'))
+            search_btn = WebDriverWait(driver, 10, poll_frequency=SLEEP_PROFILE['poll']).until(
+                EC.element_to_be_clickable(SEARCH_BTN_LOC)
             )
+            # Keep the current result row so a stale one is never taken for the new result
+            old_row = next(iter(driver.find_elements(*RESULT_ROW_LOC)), None)
             search_btn.click()
             logger.info("Clicked search button")
-            time.sleep(3)
-            for msg in driver.find_elements(By.CLASS_NAME, "z-notification-content"):
-                if "debe ingresar un valor" in msg.text.lower():
-                    raise Exception("Input validation error: Must enter a value")
+            wait_for_search_response(driver, old_row)
+            try:
+                check_for_loading(driver)
+            except TimeoutException:
+                pass
+            messages = driver.execute_script(NOTIFICATION_TEXTS_JS)
+            if any(VALIDATION_ERROR_TEXT in msg.lower() for msg in messages):
+                raise Exception("Input validation error: Must enter a value")
             # Optionally verify the input value if possible
             try:
-                gde_input_check = driver.find_element(By.CSS_SELECTOR, input_selector)
-                if gde_input_check.get_attribute('value') != expediente:
-                    logger.warning(f"Input value changed after search click. Expected: '{expediente}', Got: '{gde_input_check.get_attribute('value')}'. This might be expected behavior.")
+                current_value = driver.execute_script(INPUT_VALUE_JS, driver.find_element(*INPUT_LOC))
+                if current_value != expediente:
+                    logger.warning(f"Input value changed after search click. Expected: '{expediente}', Got: '{current_value}'. This might be expected behavior.")
             except StaleElementReferenceException:
                 logger.info("Input element became stale after search; which is expected.")
             return True
@@ -831,22 +1145,368 @@ def type_and_search(driver, expediente, max_attempts=3):
             logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
             if attempt < max_attempts - 1:
                 driver.refresh()
-                time.sleep(5)
+                time.sleep(_backoff(attempt))
                 continue
             raise Exception("Failed to type and search after multiple attempts")
     return False
 
+def open_expediente(driver, expediente):
+    """
+    Re-login if needed, search for the expediente, wait for its single result
+    row and open the Visualizar modal. Runs as one blocking sequence so the
+    caller pays a single worker-thread hop per attempt.
+    """
+    # check_and_relogin already reapplies navigation after logging in
+    check_and_relogin(driver)
+
+    # Type and search with retry logic
+    if not type_and_search(driver, expediente):
+        raise Exception("Failed to type and search after multiple attempts")
+
+    # --- Wait for exactly one row in results ---
+    row = wait_for_single_result(driver, timeout=20)
+    logger.info("One result row detected.")
+
+    # --- Click the combo to select "Visualizar" ---
+    click_visualizar_option(driver, expediente, row)
+
+# ---------------------------------------------
+# INPUT FILES
+# ---------------------------------------------
+EXPEDIENTE_COLUMN = "Número Expediente"
+
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+def _csv_encoding(input_path):
+    """
+    Guess the CSV encoding from the first 64 KB of the file, trying UTF-8 first.
+    read_expedientes falls back to latin-1 if a later part does not decode.
+    """
+    with open(input_path, 'rb') as f:
+        sample = f.read(ENCODING_SAMPLE_SIZE)
+    try:
+        # Incremental decoder so a multi-byte character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        logger.info("UTF-8 encoding failed, trying with auto detection")
+        import chardet
+        result = chardet.detect(sample)
+        detected_encoding = result['encoding'] or 'latin-1'
+        logger.info(f"Detected encoding: {detected_encoding}")
+        return detected_encoding
+
+def _column_index(header):
+    try:
+        return list(header).index(EXPEDIENTE_COLUMN)
+    except ValueError:
+        raise ValueError(f"Column '{EXPEDIENTE_COLUMN}' not found in file")
+
+def read_expedientes(input_path):
+    """
+    Yield the stripped, non-empty values of the 'Número Expediente' column of a
+    CSV or XLSX file, one row at a time.
+    """
+    if input_path.lower().endswith(".xlsx"):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("Missing required package: openpyxl (pip install openpyxl or conda install openpyxl)")
+        workbook = openpyxl.load_workbook(input_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            column = _column_index(next(rows, ()))
+            for row in rows:
+                if column < len(row) and row[column] is not None:
+                    value = str(row[column]).strip()
+                    if value:
+                        yield value
+        finally:
+            workbook.close()
+    else:
+        encoding = _csv_encoding(input_path)
+        column = None
+        rows_read = 0
+        while True:
+            try:
+                with open(input_path, newline='', encoding=encoding) as f:
+                    reader = csv.reader(f)
+                    header = next(reader, [])
+                    if column is None:
+                        column = _column_index(header)
+                    # On a retry, skip the header and the rows already yielded
+                    # with the first encoding
+                    for row in itertools.islice(reader, rows_read, None):
+                        rows_read += 1
+                        if column < len(row):
+                            value = row[column].strip()
+                            if value:
+                                yield value
+                return
+            except UnicodeDecodeError:
+                # The sample decoded but a later part of the file does not;
+                # latin-1 maps every byte, so this retry cannot fail again
+                if encoding == 'latin-1':
+                    raise
+                logger.info(f"{encoding} decoding failed past the sample, falling back to latin-1")
+                encoding = 'latin-1'
+
+def extract_input_from_zip(zip_path, temp_dir):
+    """
+    Extract the CSV or XLSX file inside a ZIP archive into temp_dir and return
+    its path. Only the chosen member is written; if there are several the user
+    picks one.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        # Top-level files only, as before: this skips nested folders such as
+        # macOS's __MACOSX/ metadata, plus dot-prefixed AppleDouble files
+        candidates = [name for name in zip_ref.namelist()
+                      if '/' not in name and not name.startswith('.')
+                      and name.lower().endswith(('.csv', '.xlsx'))]
+
+        if not candidates:
+            raise ValueError("No CSV or XLSX files found in the ZIP archive")
+
+        if len(candidates) > 1:
+            print("Multiple files found in ZIP. Please select one:")
+            for i, name in enumerate(candidates):
+                print(f"{i+1}. {name}")
+            selection = int(input("Enter number: ")) - 1
+            if selection < 0 or selection >= len(candidates):
+                raise ValueError("Invalid selection")
+            selected_file = candidates[selection]
+        else:
+            selected_file = candidates[0]
+
+        logger.info(f"Extracting {selected_file} to temporary directory: {temp_dir}")
+        return zip_ref.extract(selected_file, temp_dir)
+
+def read_previous_results(results_csv):
+    """
+    Return (completed, failed): the sets of expedientes marked as downloaded
+    and as not downloaded in a previous results CSV.
+    """
+    completed, failed = set(), set()
+    if not os.path.exists(results_csv):
+        return completed, failed
+    with open(results_csv, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            (completed if row.get("Downloaded") == "True" else failed).add(row["Expediente"])
+    return completed, failed
+
+# ---------------------------------------------
+# DRIVER POOL
+# ---------------------------------------------
+def start_worker(worker_id, url, driver_path):
+    """
+    Start a Chrome driver for one worker, log in and navigate to the search page.
+    Returns (driver, download_dir).
+    """
+    driver, download_dir = initialize_driver(worker_id, driver_path)
+    try:
+        logger.info(f"[worker-{worker_id}] Navigating to {url}")
+        driver.get(url)
+
+        # Wait until either the login form or the logged-in home page shows up
+        WebDriverWait(driver, 30, poll_frequency=SLEEP_PROFILE['poll']).until(
+            lambda d: d.find_elements(*LOGIN_OR_HOME_LOC)
+        )
+        # The persistent profile usually still holds a valid session, so only
+        # log in when the login form is shown (check_and_relogin also navigates)
+        if check_and_relogin(driver):
+            navigated = True
+        else:
+            logger.info(f"[worker-{worker_id}] Reusing existing session from Chrome profile")
+            navigated = reapply_navigation(driver)
+
+        # Continue even if navigation failed
+        if not navigated:
+            logger.warning("Navigation reapplication failed, will attempt to continue anyway")
+            # Let the page finish loading before inspecting it
+            wait_for_page_ready(driver)
+
+            # Take a screenshot to see where we are
+            if DEBUG_SCREENSHOTS:
+                try:
+                    screenshot_path = os.path.join(SCRIPT_DIR, f"post_login_state_{worker_id}.png")
+                    driver.save_screenshot(screenshot_path)
+                    logger.info(f"Current page state saved to {screenshot_path}")
+                except Exception as ss_err:
+                    logger.error(f"Failed to save screenshot: {ss_err}")
+
+            # Check if we need to refresh the page
+            try:
+                if page_mentions(driver, "error", "expired"):
+                    logger.warning("Page appears to have error or session expired message, refreshing")
+                    driver.refresh()
+                    wait_for_page_ready(driver)
+            except:
+                pass
+    except Exception:
+        driver.quit()
+        raise
+    return driver, download_dir
+
+# Consecutive failed expedientes after which a worker's page is refreshed
+REFRESH_AFTER_FAILURES = 2
+
+class DriverPool:
+    """
+    A fixed set of logged-in Chrome drivers shared by concurrently processed
+    expedientes. Each driver is paired with its own download directory.
+    """
+
+    def __init__(self):
+        self.workers = []
+        self.failures = {}  # driver -> consecutive failed expedientes
+        self._queue = asyncio.Queue()
+
+    async def start(self, size, url):
+        """Start `size` workers in parallel; fail only if none of them come up."""
+        # Resolve (and if needed download) chromedriver once for all workers
+        driver_path = await asyncio.to_thread(resolve_driver_path)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(start_worker, worker_id, url, driver_path) for worker_id in range(size)),
+            return_exceptions=True,
+        )
+        for worker_id, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"Worker {worker_id} failed to start: {result}")
+                continue
+            self.workers.append(result)
+            self._queue.put_nowait(result)
+        if not self.workers:
+            raise Exception("Failed to start any Chrome driver")
+        logger.info(f"Driver pool ready with {len(self.workers)} worker(s)")
+
+    async def acquire(self):
+        """Borrow a (driver, download_dir) pair, waiting until one is free."""
+        return await self._queue.get()
+
+    def release(self, worker):
+        """Return a borrowed (driver, download_dir) pair to the pool."""
+        self._queue.put_nowait(worker)
+
+    def close(self):
+        for driver, _ in self.workers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning(f"Error quitting driver: {e}")
+        logger.info("Driver pool closed.")
+
+def collect_downloads(download_dir):
+    """
+    Move finished downloads from a worker directory into DOWNLOADS_DIR.
+    Returns the names of the moved files.
+    """
+    moved = []
+    with os.scandir(download_dir) as it:
+        for entry in it:
+            if entry.name.endswith(('.crdownload', '.tmp')) or not entry.is_file():
+                continue
+            os.replace(entry.path, os.path.join(DOWNLOADS_DIR, entry.name))
+            moved.append(entry.name)
+    return moved
+
+def _download_key(name):
+    """Normalize a downloaded filename or an expediente for exact comparison."""
+    if name.startswith('Documentos-'):
+        name = name[len('Documentos-'):]
+    return _normalize(name.replace(' CON PASE', '').replace('.zip', ''))
+
+def build_download_index(directory):
+    """Map the normalized key of every finished download in directory to its filename."""
+    with os.scandir(directory) as it:
+        return {
+            _download_key(e.name): e.name for e in it
+            if e.is_file() and not e.name.endswith(('.crdownload', '.tmp'))
+        }
+
+def _already_downloaded(downloaded, expediente):
+    """Return the file already downloaded for expediente, or None."""
+    key = _download_key(expediente)
+    encoded = key.replace('#', '%')
+    for candidate in (key, encoded, encoded.replace('%', '')):
+        if candidate in downloaded:
+            return downloaded[candidate]
+    return None
+
+async def process_expediente(pool, index, expediente, results, known_files):
+    """
+    Search, open and download a single expediente using a driver borrowed from
+    the pool, then write the outcome with the `results` csv writer. `known_files`
+    is the index from build_download_index; expedientes found in it skip the browser.
+    """
+    existing = _already_downloaded(known_files, expediente)
+    if existing:
+        logger.info(f"File for expediente {expediente} already exists: {existing}. Skipping.")
+        results.writerow([expediente, True, ""])
+        return
+
+    driver, download_dir = await pool.acquire()
+    try:
+        logger.info(f"==> Processing expediente: {expediente} (Row {index+1})")
+
+        # Refresh only when the previous expediente left the UI dirty
+        try:
+            state = await _run(_probe, driver)
+            drifted = state['modal'] or state['notification']
+        except Exception:
+            drifted = True
+        if drifted or pool.failures.get(driver, 0) >= REFRESH_AFTER_FAILURES:
+            logger.info("Refreshing page to reset UI state...")
+            await _run(driver.refresh)
+            await _run(WebDriverWait(driver, 30, poll_frequency=SLEEP_PROFILE['poll']).until,
+                lambda d: d.find_elements(*INPUT_LOC) or d.find_elements(*LOGIN_OR_HOME_LOC)
+            )
+            if not await _run(reapply_navigation, driver):
+                logger.warning(f"Failed to reapply navigation after refreshing page for expediente {expediente}")
+                # Try to continue anyway
+
+        attempt_count = 0
+        max_attempts = 5
+        downloaded = False
+        error_message = ""
+        while attempt_count < max_attempts:
+            try:
+                attempt_count += 1
+                # --- Search and open the Visualizar modal in one worker thread hop ---
+                await _run(open_expediente, driver, expediente)
+                # --- In the modal, click download and then close modal ---
+                res, err = await handle_modal_download(driver, expediente, download_dir)
+                if not res:
+                    error_message = err
+                    raise Exception(f"Modal download error: {err}")
+                for name in collect_downloads(download_dir):
+                    known_files[_download_key(name)] = name
+
+                logger.info(f"Successfully processed expediente: {expediente}")
+                downloaded = True
+                break  # Exit the retry loop on success
+            except Exception as ex:
+                logger.warning(f"Attempt {attempt_count} for expediente {expediente} failed: {str(ex)}")
+                await _run(check_and_relogin, driver)
+                await asyncio.sleep(_backoff(attempt_count - 1))
+        if not downloaded and error_message == "":
+            error_message = f"Exceeded {max_attempts} attempts"
+        pool.failures[driver] = 0 if downloaded else pool.failures.get(driver, 0) + 1
+        results.writerow([expediente, downloaded, error_message])
+    finally:
+        pool.release((driver, download_dir))
+
 # ---------------------------------------------
 # MAIN ASYNC WORKFLOW
 # ---------------------------------------------
 async def async_main():
     try:
-        load_dotenv()
         url = os.getenv("URL")
         if not url:
             raise ValueError("URL environment variable is not set")
         if not url.startswith("http"):
             raise ValueError(f"Invalid URL format: {url}")
+        if not GDE_USER or not GDE_PASS:
+            raise ValueError("Credentials are not set (GDE_USERNAME/GDE_PASSWORD or USERNAME/PASSWORD)")
         logger.info(f"Using URL: {url}")
 
         # Ask user for CSV or XLSX path
@@ -855,197 +1515,101 @@ async def async_main():
         if not os.path.exists(input_path):
             raise FileNotFoundError(f"File not found: {input_path}")
 
-        # Handle ZIP files
+        # Handle ZIP files; the extracted file only lives until the expedientes are read
+        zip_temp_dir = None
         if input_path.lower().endswith(".zip"):
             logger.info(f"Detected ZIP file: {input_path}")
-            import zipfile
-            import tempfile
-            
-            # Create a temporary directory to extract files
-            with tempfile.TemporaryDirectory() as temp_dir:
-                logger.info(f"Extracting ZIP to temporary directory: {temp_dir}")
-                try:
-                    with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                        zip_ref.extractall(temp_dir)
-                    
-                    # Find CSV or XLSX files in the extracted contents
-                    extracted_files = [f for f in os.listdir(temp_dir) if f.lower().endswith(('.csv', '.xlsx'))]
-                    
-                    if not extracted_files:
-                        raise ValueError("No CSV or XLSX files found in the ZIP archive")
-                    
-                    if len(extracted_files) > 1:
-                        print("Multiple files found in ZIP. Please select one:")
-                        for i, file in enumerate(extracted_files):
-                            print(f"{i+1}. {file}")
-                        selection = int(input("Enter number: ")) - 1
-                        if selection < 0 or selection >= len(extracted_files):
-                            raise ValueError("Invalid selection")
-                        selected_file = extracted_files[selection]
-                    else:
-                        selected_file = extracted_files[0]
-                    
-                    # Update input_path to point to the extracted file
-                    input_path = os.path.join(temp_dir, selected_file)
-                    logger.info(f"Using extracted file: {selected_file}")
-                    
-                except Exception as e:
-                    logger.error(f"Error extracting ZIP file: {e}")
-                    raise
-        
-        # Check if file is Excel and verify openpyxl is installed
-        if input_path.lower().endswith(".xlsx"):
-            try:
-                import openpyxl
-            except ImportError:
-                logger.error("The openpyxl package is required to read Excel files.")
-                print("\nPlease install openpyxl using one of these commands:")
-                print("pip install openpyxl")
-                print("- or -")
-                print("conda install openpyxl")
-                raise ImportError("Missing required package: openpyxl")
-            df = pd.read_excel(input_path)
-        else:
-            # Try different encodings if UTF-8 fails
+            zip_temp_dir = tempfile.TemporaryDirectory()
             try:
-                df = pd.read_csv(input_path, encoding='utf-8', sep=',', engine='python')
-            except UnicodeDecodeError:
-                try:
-                    logger.info("UTF-8 encoding failed, trying latin-1")
-                    df = pd.read_csv(input_path, encoding='latin-1', sep=',', engine='python')
-                except Exception as e:
-                    logger.info("latin-1 encoding failed, trying with auto detection")
-                    import chardet
-                    with open(input_path, 'rb') as f:
-                        result = chardet.detect(f.read())
-                    detected_encoding = result['encoding']
-                    logger.info(f"Detected encoding: {detected_encoding}")
-                    df = pd.read_csv(input_path, encoding=detected_encoding, sep=',', engine='python')
-
-        if "Número Expediente" not in df.columns:
-            raise ValueError("Column 'Número Expediente' not found in file")
-
-        data_dir = os.path.join(os.getcwd(), "data")
-        os.makedirs(data_dir, exist_ok=True)
-        results_csv = os.path.join(data_dir, "expedientes.csv")
-        with open(results_csv, 'w', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerow(["Expediente", "Downloaded", "Error"])
-
-        driver, download_dir = initialize_driver()
+                input_path = extract_input_from_zip(input_path, zip_temp_dir.name)
+            except Exception as e:
+                zip_temp_dir.cleanup()
+                logger.error(f"Error extracting ZIP file: {e}")
+                raise
+
+        os.makedirs(DATA_DIR, exist_ok=True)
+        results_csv = os.path.join(DATA_DIR, "expedientes.csv")
 
+        # Drop repeated rows and expedientes a previous run already downloaded
         try:
-            logger.info(f"Navigating to {url}")
-            driver.get(url)
-            await asyncio.to_thread(handle_login, driver)
-            
-            # Try to reapply navigation, but continue even if it fails
-            if not reapply_navigation(driver):
-                logger.warning("Navigation reapplication failed, will attempt to continue anyway")
-                # Give the page some time to stabilize
-                time.sleep(5)
-                
-                # Take a screenshot to see where we are
-                try:
-                    screenshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "post_login_state.png")
-                    driver.save_screenshot(screenshot_path)
-                    logger.info(f"Current page state saved to {screenshot_path}")
-                except Exception as ss_err:
-                    logger.error(f"Failed to save screenshot: {ss_err}")
-                
-                # Check if we need to refresh the page
-                try:
-                    if "error" in driver.page_source.lower() or "expired" in driver.page_source.lower():
-                        logger.warning("Page appears to have error or session expired message, refreshing")
-                        driver.refresh()
-                        time.sleep(5)
-                except:
-                    pass
-            
-            # For each expediente in the file
-            for index, row in df.iterrows():
-                # Get the expediente exactly as it is in Excel, just strip any leading/trailing whitespace
-                expediente = str(row["Número Expediente"]).strip()
-                logger.info(f"==> Processing expediente: {expediente} (Row {index+1})")
-                
-                # Refresh the page every 5 expedientes to keep UI state clean
-                if index > 0 and index % 5 == 0:
-                    logger.info("Refreshing page to maintain clean UI state...")
-                    driver.refresh()
-                    time.sleep(5)
-                    if not reapply_navigation(driver):
-                        logger.warning(f"Failed to reapply navigation after refreshing page for expediente {expediente}")
-                        # Try to continue anyway
-                    time.sleep(2)
-                
-                attempt_count = 0
-                max_attempts = 5
-                downloaded = False
-                error_message = ""
-                while attempt_count < max_attempts:
-                    try:
-                        attempt_count += 1
-                        if check_and_relogin(driver):
-                            if not reapply_navigation(driver):
-                                logger.warning(f"Failed to reapply navigation after session expired for expediente {expediente}")
-                                # Try to continue anyway
-                        
-                        # Type and search with retry logic
-                        if not await asyncio.to_thread(type_and_search, driver, expediente):
-                            raise Exception("Failed to type and search after multiple attempts")
-                        
-                        # Add delay after search to ensure page loads
-                        time.sleep(5)  # Wait for search results
-                        
-                        # --- Wait for exactly one row in results ---
-                        await asyncio.to_thread(wait_for_single_result, driver, timeout=15)
-                        logger.info("One result row detected.")
-                        
-                        # Add delay before clicking combo
-                        time.sleep(2)
-                        
-                        # --- Click the combo to select "Visualizar" ---
-                        await asyncio.to_thread(click_visualizar_option, driver, expediente)
-                        # --- In the modal, click download and then close modal ---
-                        res, err = await handle_modal_download(driver, expediente, download_dir)
-                        if not res:
-                            error_message = err
-                            raise Exception(f"Modal download error: {err}")
-                        
-                        # Clear search state to prevent looping on the same expediente
-                        # await clear_search_state(driver)  # Commented out to prevent automatic clearing of search input
-                        
-                        logger.info(f"Successfully processed expediente: {expediente}")
-                        downloaded = True
-                        break  # Exit the retry loop on success
-                    except Exception as ex:
-                        logger.warning(f"Attempt {attempt_count} for expediente {expediente} failed: {str(ex)}")
-                        if check_session_expired(driver):
-                            handle_login(driver)
-                            if not reapply_navigation(driver):
-                                logger.warning(f"Failed to reapply navigation after session expired for expediente {expediente}")
-                                # Try to continue anyway
-                        time.sleep(3)
-                if not downloaded and error_message == "":
-                    error_message = f"Exceeded {max_attempts} attempts"
-                with open(results_csv, 'a', newline='', encoding='utf-8') as f:
-                    csv.writer(f).writerow([expediente, downloaded, error_message])
-            # Wait for downloads to finish
-            logger.info("Waiting for downloads to complete...")
-            end_time = time.time() + 60
-            while time.time() < end_time:
-                if not [f for f in os.listdir(download_dir) if f.endswith('.crdownload') or f.endswith('.tmp')]:
-                    break
-                time.sleep(0.5)
+            expedientes = list(dict.fromkeys(read_expedientes(input_path)))
         finally:
-            driver.quit()
-            logger.info("Driver quit.")
+            if zip_temp_dir:
+                zip_temp_dir.cleanup()
+        completed, failed = read_previous_results(results_csv)
+        done = [expediente for expediente in expedientes if expediente in completed]
+        expedientes = [expediente for expediente in expedientes if expediente not in completed]
+        if done:
+            logger.info(f"Skipping {len(done)} expediente(s) already downloaded in a previous run")
+        # Longest first: expedientes that failed last time tend to run into
+        # timeouts and retries again, so start them before the rest to
+        # shorten the tail of the run. The sort is stable, so the input
+        # order is kept within each group.
+        expedientes.sort(key=lambda expediente: expediente not in failed)
 
-        final_files = os.listdir(download_dir)
-        logger.info(f"Files in downloads directory: {final_files}")
+        # Files already in the downloads directory need no browser at all, so
+        # drop them before any Chrome is launched or logged in
+        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+        known_files = build_download_index(DOWNLOADS_DIR)
+        pending = []
+        for expediente in expedientes:
+            (done if _already_downloaded(known_files, expediente) else pending).append(expediente)
+        if len(pending) < len(expedientes):
+            logger.info(f"Skipping {len(expedientes) - len(pending)} expediente(s) whose file is already in {DOWNLOADS_DIR}")
+            expedientes = pending
+
+        # Rows are written from the event loop thread only, so one writer is
+        # shared without locking. Line buffering keeps every finished row on
+        # disk, so an interrupted run can resume from the results file.
+        with open(results_csv, 'w', newline='', encoding='utf-8', buffering=1) as f:
+            results = csv.writer(f)
+            results.writerow(["Expediente", "Downloaded", "Error"])
+            results.writerows([expediente, True, ""] for expediente in done)
+            if not expedientes:
+                print("\nAll expedientes were already downloaded.")
+                return
+
+            pool = DriverPool()
+            try:
+                await pool.start(min(POOL_SIZE, len(expedientes)), url)
+
+                # Process expedientes concurrently; the pool bounds how many run at once
+                outcomes = await asyncio.gather(*(
+                    process_expediente(pool, index, expediente, results, known_files)
+                    for index, expediente in enumerate(expedientes)
+                ), return_exceptions=True)
+                # One expediente failing unexpectedly must not cancel the others
+                for expediente, outcome in zip(expedientes, outcomes):
+                    if isinstance(outcome, Exception):
+                        logger.error(f"Expediente {expediente} failed: {outcome}")
+                        results.writerow([expediente, False, str(outcome)])
+
+                # Wait for downloads to finish
+                logger.info("Waiting for downloads to complete...")
+                await wait_for_pending_downloads([download_dir for _, download_dir in pool.workers])
+                for _, download_dir in pool.workers:
+                    collect_downloads(download_dir)
+            finally:
+                pool.close()
+
+        with os.scandir(DOWNLOADS_DIR) as it:
+            final_count = sum(1 for e in it if e.is_file())
+        logger.info(f"Files in downloads directory: {final_count}")
         print("\nAutomation completed. Please check your downloads folder for files.")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
         raise
 
 if __name__ == "__main__":
-    asyncio.run(async_main())
+    try:
+        # Optional faster event loop; uvloop is not available on Windows
+        import uvloop
+    except ImportError:
+        asyncio.run(async_main())
+    else:
+        if hasattr(uvloop, "run"):
+            uvloop.run(async_main())
+        else:
+            # uvloop before 0.18 has no run(); install its policy instead
+            uvloop.install()
+            asyncio.run(async_main())
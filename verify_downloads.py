@@ -1,55 +1,157 @@
+import argparse
+import multiprocessing
 import os
-import pandas as pd
+import re
+import sys
+from functools import lru_cache
+import openpyxl
 from pathlib import Path
 
-def normalize_expediente(text):
-    """Normalize expediente string for comparison."""
-    # Convert to string and normalize
-    text = str(text).strip()
-    
-    # Remove prefix if present
-    if text.startswith('Documentos-'):
-        text = text[len('Documentos-'):]
-        
-    # Remove suffix if present
-    if ' CON PASE' in text:
-        text = text.replace(' CON PASE', '')
-    if '.zip' in text:
-        text = text.replace('.zip', '')
-        
-    # Handle special characters
-    text = text.replace('#', '%')
-    
-    # Remove all whitespace
-    text = "".join(text.split())
-    
-    return text
+try:
+    # Rust-based reader: much faster and lighter than openpyxl on large sheets
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+try:
+    # Vectorized C++ string kernels for normalizing whole columns at once
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+# "Documentos-" prefix, " CON PASE" suffix, ".zip" extension and all whitespace,
+# removed in a single scan; "#" is then mapped to "%". The suffix also takes
+# any whitespace before it, or \s+ would consume its leading space first.
+_STRIP_RE = re.compile(r'^Documentos-|\s* CON PASE|\.zip|\s+')
+_TRANS = str.maketrans({'#': '%'})
+
+@lru_cache(maxsize=None, typed=True)
+def normalize_expediente(text, _re=_STRIP_RE, _tr=_TRANS, _str=str, _intern=sys.intern):
+    """Normalize expediente string for comparison. Cached, as sheets repeat values;
+    typed so that equal cells of different types (1.0, True) keep their own key.
+
+    The keyword defaults bind module constants as locals for the hot loop.
+    """
+    s = (text if isinstance(text, _str) else _str(text)).strip()
+    if not s:
+        return ""
+    # Interned so both lookup dicts share one key object per expediente
+    return _intern(_re.sub('', s).translate(_tr))
+
+# Download names are always "<name>.zip", so only these need a regex scan
+_NAME_STRIP_RE = re.compile(r'\s* CON PASE|\s+')
+
+def normalize_filename(name, _re=_NAME_STRIP_RE, _tr=_TRANS, _intern=sys.intern):
+    """normalize_expediente specialized for the .zip names in the downloads dir."""
+    name = name.strip()
+    if name.startswith('Documentos-'):
+        name = name[len('Documentos-'):]
+    if name.endswith('.zip'):
+        name = name[:-4]
+    return _intern(_re.sub('', name).translate(_tr))
+
+# Below this many values a process pool costs more to start than it saves
+PARALLEL_THRESHOLD = 50_000
+
+def normalize_all(values):
+    """Normalize a list of values, spreading large lists across CPU cores."""
+    if pc is not None:
+        return normalize_arrow(values)
+    if len(values) < PARALLEL_THRESHOLD:
+        return list(map(normalize_expediente, values))
+    with multiprocessing.Pool() as pool:
+        normalized = pool.map(normalize_expediente, values, chunksize=2048)
+    # Strings come back unpickled, so re-intern them in this process
+    return list(map(sys.intern, normalized))
+
+# RE2 spelling of str.strip() and _STRIP_RE. RE2's \s is ASCII-only and
+# misses \v, so the class lists every character str.isspace() accepts.
+_WS_RE2 = r'[\t-\r\x1c-\x1f\x85\p{Z}]'
+_TRIM_RE2 = rf'^{_WS_RE2}+|{_WS_RE2}+$'
+_STRIP_RE2 = rf'^Documentos-|{_WS_RE2}* CON PASE|\.zip|{_WS_RE2}+'
+
+def normalize_arrow(values):
+    """Same result as normalize_expediente, computed with pyarrow kernels."""
+    arr = pa.array([v if isinstance(v, str) else str(v) for v in values], type=pa.string())
+    arr = pc.replace_substring_regex(arr, pattern=_TRIM_RE2, replacement="")
+    arr = pc.replace_substring_regex(arr, pattern=_STRIP_RE2, replacement="")
+    arr = pc.replace_substring(arr, pattern="#", replacement="%")
+    return list(map(sys.intern, arr.to_pylist()))
+
+def read_expediente_column(excel_path, max_rows=None):
+    """Return (row count, non-empty values) for column D below the header row.
+
+    Empty cells are dropped while reading. When max_rows is set, parsing
+    stops after that many data rows.
+    """
+    if CalamineWorkbook is not None:
+        nrows = max_rows + 1 if max_rows is not None else None
+        rows = CalamineWorkbook.from_path(str(excel_path)).get_sheet_by_index(0).to_python(skip_empty_area=False, nrows=nrows)[1:]
+        # calamine returns every numeric cell as a float; give whole numbers
+        # back as int so 12345 normalizes to "12345" as with openpyxl
+        return len(rows), [int(v) if isinstance(v, float) and v.is_integer() else v
+                           for v in (row[3] for row in rows if len(row) > 3) if v != ""]
+    # Stream only column D; read-only mode never builds the full cell grid
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        max_row = max_rows + 1 if max_rows is not None else None
+        total = 0
+        values = []
+        for (value,) in workbook.worksheets[0].iter_rows(min_row=2, max_row=max_row, min_col=4, max_col=4, values_only=True):
+            total += 1
+            if value is not None and value != "":
+                values.append(value)
+        return total, values
+    finally:
+        workbook.close()
+
+def max_rows_arg(value):
+    """argparse type for --max-rows and VERIFY_MAX_ROWS: 0 means no cap."""
+    n = int(value)
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {n}")
+    return n or None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check downloaded expedientes against the Excel list.")
+    parser.add_argument("--excel", type=Path, help="Excel file to read (default: first .xlsx in the current directory)")
+    parser.add_argument("--downloads", type=Path, default=Path("downloads"), help="Directory with the downloaded .zip files")
+    parser.add_argument("--max-rows", type=max_rows_arg, default=os.getenv("VERIFY_MAX_ROWS", "0"), help="Read at most this many data rows (0 for all; default: $VERIFY_MAX_ROWS)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     # Get the absolute path to the downloads directory
-    downloads_dir = Path("downloads").absolute()
-    if not downloads_dir.exists():
+    downloads_dir = args.downloads.absolute()
+
+    # Get list of downloaded file names; a missing directory surfaces here
+    try:
+        with os.scandir(downloads_dir) as it:
+            downloaded_names = [e.name for e in it if e.name.endswith(".zip") and e.is_file(follow_symlinks=False)]
+    except FileNotFoundError:
         print(f"Error: Downloads directory not found at {downloads_dir}")
         return
 
-    # Find Excel file in root directory
-    excel_files = list(Path(".").glob("*.xlsx"))
-    if not excel_files:
+    # Use the given Excel file, or find one in the root directory
+    excel_path = args.excel
+    if excel_path is None:
+        with os.scandir(".") as it:
+            excel_path = next((e.name for e in it if e.name.endswith(".xlsx") and e.is_file()), None)
+    if excel_path is None:
         print("Error: No Excel file found in root directory")
         return
     
-    excel_path = excel_files[0]
     print(f"Using Excel file: {excel_path}")
 
     try:
         # Read Excel file, using column D for expedientes (no skipping rows)
-        df = pd.read_excel(excel_path, usecols=[3])  # Column D is index 3 (0-based)
-        expedientes = df.iloc[:, 0]  # Get the first (and only) column
+        total_rows, valid_expedientes = read_expediente_column(excel_path, args.max_rows)
         
         # Print detailed Excel information
-        total_rows = len(expedientes)
-        empty_rows = expedientes.isna().sum()
-        valid_rows = total_rows - empty_rows
+        valid_rows = len(valid_expedientes)
+        empty_rows = total_rows - valid_rows
         print(f"\nExcel file details:")
         print(f"Total rows: {total_rows}")
         print(f"Empty rows: {empty_rows}")
@@ -58,56 +160,37 @@ def main():
         print(f"Error reading Excel file: {e}")
         return
 
-    # Get list of downloaded files
-    downloaded_files = list(downloads_dir.glob("*.zip"))
-    
-    # Track results
-    missing_files = []
-    extra_files = []
-    found_files = []
-    
     # Create dictionaries of normalized values for comparison
-    normalized_downloads = {normalize_expediente(f.name): f.name for f in downloaded_files}
-    
-    # Include all rows, even empty ones, in the expedientes dictionary
-    normalized_expedientes = {}
-    for exp in expedientes:
-        if pd.notna(exp):  # If not empty
-            norm_exp = normalize_expediente(exp)
-            normalized_expedientes[norm_exp] = exp
-    
-    print(f"\nChecking {len(normalized_expedientes)} expedientes against {len(downloaded_files)} downloaded files...")
+    normalized_downloads = {normalize_filename(name): name for name in downloaded_names}
+    normalized_expedientes = dict(zip(normalize_all(valid_expedientes), valid_expedientes))
     
-    # Check for missing files
-    for norm_exp, original_exp in normalized_expedientes.items():
-        if norm_exp in normalized_downloads:
-            found_files.append(normalized_downloads[norm_exp])
-        else:
-            missing_files.append(original_exp)
+    print(f"\nChecking {len(normalized_expedientes)} expedientes against {len(downloaded_names)} downloaded files...")
     
-    # Check for extra files
-    for norm_download, original_filename in normalized_downloads.items():
-        if norm_download not in normalized_expedientes:
-            extra_files.append(original_filename)
+    # Compare the normalized keys with set operations
+    expediente_keys = normalized_expedientes.keys()
+    download_keys = normalized_downloads.keys()
+    missing_keys = expediente_keys - download_keys
+    extra_keys = download_keys - expediente_keys
+    # Listed in input order, so a missing entry can be traced back to its Excel row
+    missing_files = [exp for k, exp in normalized_expedientes.items() if k in missing_keys]
+    extra_files = [name for k, name in normalized_downloads.items() if k in extra_keys]
+    found_count = len(expediente_keys & download_keys)
     
     # Print results
     print("\nResults:")
     print(f"Total rows in Excel (excluding header): {total_rows}")
     print(f"Valid expedientes in Excel: {valid_rows}")
-    print(f"Total files in downloads: {len(downloaded_files)}")
-    print(f"Files found: {len(found_files)}")
+    print(f"Total files in downloads: {len(downloaded_names)}")
+    print(f"Files found: {found_count}")
     
+    # Each listing goes out in a single write instead of one print per line
     if missing_files:
-        print(f"\nMissing files ({len(missing_files)}):")
-        for exp in missing_files:
-            print(f"- {exp}")
+        sys.stdout.write(f"\nMissing files ({len(missing_files)}):\n" + "".join(f"- {exp}\n" for exp in missing_files))
     else:
         print("\nNo missing files!")
         
     if extra_files:
-        print(f"\nExtra files in downloads ({len(extra_files)}):")
-        for file in extra_files:
-            print(f"- {file}")
+        sys.stdout.write(f"\nExtra files in downloads ({len(extra_files)}):\n" + "".join(f"- {file}\n" for file in extra_files))
     else:
         print("\nNo extra files!")
 